@@ -1,7 +1,120 @@
+import errno
 import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait
 from enum import Enum
+from itertools import batched, islice
+from operator import attrgetter
+
+try:
+    import ctypes
+except ImportError:
+    ctypes = None
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
 
 SCRIPT_NAME = "files_mover.py"
+IO_URING_ENTRIES = 256
+IO_URING_BATCH = 128
+RENAME_BATCH = 64
+# Working relative to open folder fds (instead of chdir and paths)
+# skips resolving the folder path on every call (POSIX only).
+DIR_FD = (hasattr(os, "O_DIRECTORY") and os.scandir in os.supports_fd and
+          {os.open, os.mkdir, os.rename, os.stat, os.unlink} <=
+          os.supports_dir_fd)
+# openat2 is 437 on these architectures (alpha and MIPS use other
+# numbers, x32 adds a flag), elsewhere plain `os.open` is used.
+SYS_OPENAT2 = 437
+OPENAT2_MACHINES = {"x86_64", "i386", "i686", "aarch64", "armv7l",
+                    "armv6l", "riscv64", "ppc", "ppc64", "ppc64le",
+                    "s390x", "loongarch64"}
+RESOLVE_BENEATH = 0x08
+
+if (ctypes is not None and sys.platform == "linux" and
+        os.uname().machine in OPENAT2_MACHINES and
+        not (os.uname().machine == "x86_64" and
+             ctypes.sizeof(ctypes.c_void_p) == 4)):
+    class _OpenHow(ctypes.Structure):
+        _fields_ = [("flags", ctypes.c_uint64),
+                    ("mode", ctypes.c_uint64),
+                    ("resolve", ctypes.c_uint64)]
+
+    _syscall = ctypes.CDLL(None, use_errno=True).syscall
+else:
+    _syscall = None
+
+
+def _file_type(name: str) -> str:
+    """
+    Extension of file name, same as `os.path.splitext(name)[1]`
+    but cheaper (it's called for every file when sorting by type).
+    :param name: file name (without folders).
+    :return: str
+    """
+    _, dot, ext = name.lstrip(".").rpartition(".")
+    return dot + ext if dot else ""
+
+
+# Sort keys for DirEntry objects. DirEntry caches its stat result,
+# so each file is stat-ed at most once, however many comparisons
+# sorting makes. `list.sort` also computes each key only once and
+# compares those keys, not entries, so moving keys into `array`
+# columns and sorting indices gains nothing (it measured slower).
+SORTING_KEYS = {
+    "ctime": lambda e: e.stat().st_ctime,
+    "mtime": lambda e: e.stat().st_mtime,
+    "name": attrgetter("name"),
+    "size": lambda e: e.stat().st_size,
+    "type": lambda e: _file_type(e.name)
+}
+
+
+def _list_files(path: str | int) -> tuple[list[os.DirEntry], list[str]]:
+    """
+    List files (not folders) in folder, except this script.
+    Listing is done by `os.scandir` in C, and only one
+    DirEntry method call per entry is made in Python.
+    :param path: path to folder or its file descriptor.
+    :return: tuple of list of DirEntry objects
+     and list of their names.
+    """
+    with os.scandir(path) as it:
+        entries = [e for e in it if not e.is_dir()]
+    names = list(map(attrgetter("name"), entries))
+    if SCRIPT_NAME in names:
+        i = names.index(SCRIPT_NAME)
+        del entries[i], names[i]
+    return entries, names
+
+
+def _open_beneath(dirfd: int, name: str) -> int:
+    """
+    Open folder `name` in folder `dirfd` to use it as `dir_fd`.
+    On Linux 5.6+ it's opened by openat2 with `RESOLVE_BENEATH`,
+    so path can't resolve outside `dirfd` (e.g. through symlink),
+    otherwise by plain `os.open`.
+    :param dirfd: file descriptor of parent folder.
+    :param name: path to folder relative to `dirfd`.
+    :return: int
+    """
+    global _syscall
+    if _syscall is not None:
+        how = _OpenHow(os.O_DIRECTORY | os.O_PATH | os.O_CLOEXEC, 0,
+                       RESOLVE_BENEATH)
+        fd = _syscall(SYS_OPENAT2, dirfd, os.fsencode(name),
+                      ctypes.byref(how), ctypes.sizeof(how))
+        if fd >= 0:
+            return fd
+        err = ctypes.get_errno()
+        if err not in (errno.ENOSYS, errno.EPERM):
+            raise OSError(err, os.strerror(err), name)
+        # older kernel (or syscall is filtered), don't try again
+        _syscall = None
+    return os.open(name, os.O_RDONLY | os.O_DIRECTORY, dir_fd=dirfd)
 
 
 class SortingVariables(Enum):
@@ -16,7 +129,7 @@ class SortingVariables(Enum):
     FILE_TYPE = "type"
 
     def __str__(self) -> str:
-        return self.value
+        return str(self.value)
 
 
 class FilesSeparator:
@@ -48,6 +161,9 @@ class FilesSeparator:
     :meth:`move()`: Actual process: creates folders and moves files
     into them. Sorting files if it set to do so.
 
+    :meth:`close()`: Close work folder. Called automatically when
+    object is used as context manager or deleted.
+
     :param work_folder: path to work folder,
      if None - work folder will be current folder
      (where script is located).
@@ -60,6 +176,9 @@ class FilesSeparator:
 
     :param start_folder_num: number of starting folder (e.g. if set
      to 3, first folder will be "folder-3" and so on).
+     Folders must be inside work folder, otherwise
+     ValueError is raised. If they are on other filesystem
+     (mount point inside work folder), files are copied.
 
     :param sorting: if None, files will be not sorted and will be
      moved randomly. Sorting variables you can grab
@@ -68,6 +187,23 @@ class FilesSeparator:
     :param reverse: if True, files will be sorted in reverse order
      (doesn't work if sorting is None).
 
+    :param use_io_uring: if True, folders will be created and files
+     will be renamed in batches through io_uring (Linux only, needs
+     `liburing` package installed), otherwise (or if io_uring
+     is unavailable) one by one.
+     If an operation fails, the rest of its batch (up to
+     `IO_URING_BATCH` operations) still runs, so failing folder may
+     miss files and next folders of the batch may be filled, but
+     nothing after that batch is done (one by one moving stops at
+     the first error).
+
+    :param max_concurrency: number of threads renaming files
+     of each folder at the same time (useful on slow or network
+     storage), if 1 - files will be renamed one after another
+     (less than 1 raises ValueError).
+
+    :param verbose: if True, progress of :meth:`move()` will be printed.
+
     Example:
 
     >>> separator = FilesSeparator(
@@ -93,21 +229,66 @@ class FilesSeparator:
             start_folder_name: str = "folder-",
             start_folder_num: int = 1,
             sorting: SortingVariables | str | None = SortingVariables.RANDOM,
-            reverse: bool = False
+            reverse: bool = False,
+            use_io_uring: bool = False,
+            max_concurrency: int = 1,
+            verbose: bool = True
     ):
-        if work_folder is not None:
-            os.chdir(work_folder)
-        self._work_folder = os.getcwd()
-        self._files = next(os.walk(self._work_folder))[2]
-        if SCRIPT_NAME in self._files:
-            self._files.remove(SCRIPT_NAME)
+        self._dirfd = None
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1!")
+        self._work_folder = os.path.realpath(
+            work_folder if work_folder is not None else os.getcwd())
+        # all folders share a parent, it must be inside work folder
+        first_folder = f"{start_folder_name}{start_folder_num}"
+        parent = os.path.realpath(os.path.dirname(
+            os.path.join(self._work_folder, first_folder)))
+        if (os.path.commonpath([parent, self._work_folder]) !=
+                self._work_folder):
+            raise ValueError(
+                f"Folder {first_folder} is outside work folder!")
+        if DIR_FD:
+            self._dirfd = os.open(self._work_folder,
+                                  os.O_RDONLY | os.O_DIRECTORY |
+                                  os.O_CLOEXEC)
+            self._entries, self._files = _list_files(self._dirfd)
+        else:
+            self._entries, self._files = _list_files(self._work_folder)
         self._n = num
         self._start_folder_name = start_folder_name
         self._start_folder_num = start_folder_num
         self._max_folder_num = (len(self._files) // self._n +
                                 (1 if len(self._files) % self._n else 0))
-        self._sorting = str(sorting)
+        self._sorting = (sorting.value
+                         if isinstance(sorting, SortingVariables)
+                         else sorting)
         self._reverse = reverse
+        self._use_io_uring = (use_io_uring and liburing is not None and
+                              sys.platform == "linux" and DIR_FD)
+        self._max_concurrency = max_concurrency
+        self._verbose = verbose
+        # nothing shown in info changes after init, so it's built once
+        self._info = {
+            "current directory": self._work_folder,
+            "number of files": len(self._files),
+            "number of folders to create": self._max_folder_num,
+            "start folder": f"{self._start_folder_name}"
+                            f"{self._start_folder_num}",
+            "end folder": f"{self._start_folder_name}"
+                          f"{self._max_folder_num +
+                             self._start_folder_num - 1}"
+        }
+        self._info_str = "\n".join(f"{k}: {v}"
+                                   for k, v in self._info.items())
+
+    def __enter__(self) -> "FilesSeparator":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        self.close()
 
     def __str__(self) -> str:
         """
@@ -124,16 +305,13 @@ class FilesSeparator:
         :class:`SortingVariables`, nothing will happen.
         :return: None
         """
-        sorting_vars = {
-            "ctime": os.path.getctime,
-            "mtime": os.path.getmtime,
-            "name": os.path.basename,
-            "size": os.path.getsize,
-            "type": lambda f: os.path.splitext(f)[1]
-        }
-        if self._sorting in sorting_vars:
-            self._files.sort(key=sorting_vars[self._sorting],
-                             reverse=self._reverse)
+        if self._sorting is None:
+            return
+        key = SORTING_KEYS.get(self._sorting)
+        if key is None:
+            return
+        self._entries.sort(key=key, reverse=self._reverse)
+        self._files = [e.name for e in self._entries]
 
     def info(self) -> dict:
         """
@@ -141,16 +319,7 @@ class FilesSeparator:
         :class:`FilesSeparator` object.
         :return: dict
         """
-        return {
-            "current directory": self._work_folder,
-            "number of files": len(self._files),
-            "number of folders to create": self._max_folder_num,
-            "start folder": f"{self._start_folder_name}"
-                            f"{self._start_folder_num}",
-            "end folder": f"{self._start_folder_name}"
-                          f"{self._max_folder_num +
-                             self._start_folder_num - 1}"
-        }
+        return self._info.copy()
 
     def info_str(self) -> str:
         """
@@ -160,7 +329,7 @@ class FilesSeparator:
         of method :meth:`info()`.
         :return: str
         """
-        return "\n".join([f"{k}: {v}" for k, v in self.info().items()])
+        return self._info_str
 
     def info_print(self):
         """
@@ -168,7 +337,202 @@ class FilesSeparator:
         :class:`FilesSeparator` object.
         :return: None
         """
-        print(self)
+        sys.stdout.write(self._info_str + "\n")
+
+    def close(self) -> None:
+        """
+        Close work folder (its file descriptor).
+        Called automatically when :class:`FilesSeparator` object
+        is used as context manager or deleted.
+        :return: None
+        """
+        if self._dirfd is not None:
+            os.close(self._dirfd)
+            self._dirfd = None
+
+    @staticmethod
+    def _io_uring_ring() -> "liburing.Ring | None":
+        """
+        Set up io_uring ring. If kernel refuses it (io_uring disabled
+        or blocked by seccomp, or setup flags unsupported by older
+        kernel), returns None, so files are moved with `os` calls.
+        :return: liburing.Ring or None
+        """
+        ring = liburing.Ring()
+        try:
+            liburing.io_uring_queue_init(
+                IO_URING_ENTRIES, ring,
+                liburing.IORING_SETUP_COOP_TASKRUN |
+                liburing.IORING_SETUP_SINGLE_ISSUER
+            )
+        except OSError:
+            return None
+        return ring
+
+    def _move_io_uring(self, ring: "liburing.Ring", folders: list[str],
+                       dsts: list[str], logs: list[str]) -> None:
+        """
+        Create folders and move files into them through io_uring.
+        Each folder's mkdir is linked to its renames, so they run in
+        order without waiting for the mkdir in Python, and operations
+        are submitted in batches of `IO_URING_BATCH` (one
+        `io_uring_enter` per batch instead of one syscall per file).
+        :param ring: ring set up by :meth:`_io_uring_ring()`,
+         it's closed when done.
+        :param folders: list of folders names.
+        :param dsts: list of destination paths, parallel to files.
+        :param logs: list to add progress messages to (a folder is
+         reported only after its mkdir has completed).
+        :return: None
+        """
+        try:
+            # (path, None) is a mkdir, (source, destination) is a rename
+            pairs = zip(self._files, dsts)
+            ops = []
+            for folder in folders:
+                ops.append((folder, None))
+                ops.extend(islice(pairs, self._n))
+            cqe = liburing.Cqe()
+            for start in range(0, len(ops), IO_URING_BATCH):
+                # `batch` keeps paths alive until the kernel has read them
+                batch = ops[start:start + IO_URING_BATCH]
+                for k, (src, dst) in enumerate(batch):
+                    sqe = liburing.io_uring_get_sqe(ring)
+                    if dst is None:
+                        liburing.io_uring_prep_mkdir(
+                            sqe, src, 0o777, dfd=self._dirfd)
+                    else:
+                        liburing.io_uring_prep_rename(
+                            sqe, src, dst,
+                            olddfd=self._dirfd, newdfd=self._dirfd)
+                    sqe.user_data = k
+                    # chain runs until the next folder's mkdir; it only
+                    # orders operations, a failure may not cancel the rest
+                    if k + 1 < len(batch) and batch[k + 1][1] is not None:
+                        liburing.io_uring_sqe_set_flags(
+                            sqe, liburing.IOSQE_IO_LINK)
+                liburing.io_uring_submit_and_wait(ring, len(batch))
+                failed = None
+                created = []
+                for _ in liburing.CqeIter(ring, cqe):
+                    entry = cqe[0]
+                    k = entry.user_data
+                    try:
+                        entry.res  # raises OSError if operation failed
+                        if batch[k][1] is None:
+                            created.append(k)
+                    except OSError as e:
+                        # report the first real error, not cancellations
+                        if (e.errno != errno.ECANCELED and
+                                (failed is None or k < failed[0])):
+                            failed = (k, e.errno)
+                    finally:
+                        liburing.io_uring_cqe_seen(ring, entry)
+                # completions may come out of order
+                logs.extend(f"Creating folder {batch[k][0]}"
+                            for k in sorted(created))
+                if failed is not None:
+                    k, err = failed
+                    src, dst = batch[k]
+                    if dst is None and err == errno.EEXIST:
+                        raise ValueError(f"Folder {src} already exists!")
+                    raise OSError(err, os.strerror(err), src, None, dst)
+        finally:
+            liburing.io_uring_queue_exit(ring)
+
+    def _probe(self, parent: str) -> bool:
+        """
+        Rename one temporary file from work folder into `parent` and
+        back, to check once (before anything is created) whether
+        files can be renamed there at all.
+        :param parent: folder for new folders, relative to work folder.
+        :return: bool, True if `parent` is on other filesystem
+         (e.g. mount point inside work folder)
+        """
+        dirfd = self._dirfd
+        name = f".files_mover-probe-{os.getpid()}"
+        if dirfd is None:
+            name = os.path.join(self._work_folder, name)
+            parent = os.path.join(self._work_folder, parent)
+        dst = os.path.join(parent, os.path.basename(name))
+        os.close(os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         dir_fd=dirfd))
+        try:
+            os.rename(name, dst, src_dir_fd=dirfd, dst_dir_fd=dirfd)
+        except OSError as e:
+            os.unlink(name, dir_fd=dirfd)
+            # other errors (e.g. missing `parent`) are left to mkdir
+            return e.errno == errno.EXDEV
+        os.unlink(dst, dir_fd=dirfd)
+        return False
+
+    def _move_os(self, folders: list[str], srcs: list[str],
+                 dsts: list[str], logs: list[str],
+                 cross_fs: bool = False) -> None:
+        """
+        Create folders and move files into them with `os` calls,
+        using `max_concurrency` threads for renames (each thread gets
+        `RENAME_BATCH` files at once, not a task per file, and does
+        nothing but renaming them).
+        :param folders: list of folders names.
+        :param srcs: list of source paths.
+        :param dsts: list of destination paths, parallel to `srcs`
+         (empty if files are renamed relative to the folder fd).
+        :param logs: list to add progress messages to.
+        :param cross_fs: if True - folders are on other filesystem,
+         so files are moved by `shutil.move` (copied) with absolute
+         `srcs` and `dsts` instead of renamed.
+        :return: None
+        """
+        n = self._n
+        dirfd = None if cross_fs else self._dirfd
+        rename = os.rename
+        srcs, dsts = iter(srcs), iter(dsts)
+
+        # renamer is picked once, not checked for every file
+        if cross_fs:
+            def move_files(pairs: tuple[tuple[str, str], ...],
+                           dfd: None) -> None:
+                for src, dst in pairs:
+                    shutil.move(src, dst)
+        else:
+            def move_files(pairs: tuple[tuple[str, str], ...],
+                           dfd: int | None) -> None:
+                for src, dst in pairs:
+                    rename(src, dst, src_dir_fd=dirfd, dst_dir_fd=dfd)
+
+        with ThreadPoolExecutor(max_workers=self._max_concurrency) as ex:
+            for folder in folders:
+                logs.append(f"Creating folder {folder}")
+                try:
+                    if dirfd is not None:
+                        os.mkdir(folder, dir_fd=dirfd)
+                    else:
+                        os.mkdir(os.path.join(self._work_folder, folder))
+                except FileExistsError:
+                    raise ValueError(
+                        f"Folder {folder} already exists!") from None
+                if dirfd is not None:
+                    dfd = _open_beneath(dirfd, folder)
+                    pairs = ((f, f) for f in islice(srcs, n))
+                else:
+                    dfd = None
+                    pairs = zip(islice(srcs, n), islice(dsts, n))
+                futures = []
+                try:
+                    for chunk in batched(pairs, RENAME_BATCH):
+                        if self._max_concurrency > 1:
+                            futures.append(ex.submit(move_files, chunk, dfd))
+                        else:
+                            move_files(chunk, dfd)
+                finally:
+                    # workers may still use `dfd`, so it's closed
+                    # only after all of them are finished
+                    wait(futures)
+                    if dfd is not None:
+                        os.close(dfd)
+                for future in futures:
+                    future.result()  # raises first error, if any
 
     def move(self) -> None:
         """
@@ -176,20 +540,48 @@ class FilesSeparator:
         Sorting files if it set to do so.
         :return: None
         """
+        if DIR_FD and self._dirfd is None:
+            raise ValueError("Work folder is closed!")
         if not self._files:
             raise ValueError("No files to move!")
-        print("Moving files to folders...")
+        if self._verbose:
+            print("Moving files to folders...")
         self._sort_files()
-        for i in range(0, self._max_folder_num):
-            folder = f"{self._start_folder_name}{i + self._start_folder_num}"
-            print("Creating folder " + folder)
-            if folder in os.listdir(self._work_folder):
-                raise ValueError("Folder already exists!")
-            os.mkdir(folder)
-            for j in range(i * self._n, (i + 1) * self._n):
-                if j < len(self._files):
-                    os.rename(self._files[j],
-                              f"{folder}/{self._files[j]}")
-                else:
-                    break
-        print("Done!")
+        n = self._n
+        srcs = self._files
+        folders = [f"{self._start_folder_name}{self._start_folder_num + i}"
+                   for i in range(self._max_folder_num)]
+        # folders' parent can be a mount point inside work folder,
+        # then renames fail, so files are copied (checked only once)
+        parent = os.path.dirname(folders[0])
+        cross_fs = bool(parent) and self._probe(parent)
+        path_mode = not DIR_FD or cross_fs
+        ring = None
+        if self._use_io_uring and not cross_fs:
+            # check up front, so nothing is moved if any folder exists
+            # (a failed mkdir doesn't stop renames linked to it)
+            for folder in folders:
+                try:
+                    os.lstat(folder, dir_fd=self._dirfd)
+                except FileNotFoundError:
+                    continue
+                raise ValueError(f"Folder {folder} already exists!")
+            ring = self._io_uring_ring()
+        # Destination paths are built once, not inside the rename loop
+        # (not needed when renaming relative to the folder fd).
+        dsts = ([] if not path_mode and ring is None else
+                [f"{folders[j // n]}/{name}" for j, name in enumerate(srcs)])
+        if path_mode:
+            srcs = [os.path.join(self._work_folder, f) for f in srcs]
+            dsts = [os.path.join(self._work_folder, d) for d in dsts]
+        # folders are reported in one write instead of a print per folder
+        logs = []
+        try:
+            if ring is not None:
+                self._move_io_uring(ring, folders, dsts, logs)
+            else:
+                self._move_os(folders, srcs, dsts, logs, cross_fs)
+            logs.append("Done!")
+        finally:
+            if self._verbose and logs:
+                sys.stdout.write("\n".join(logs) + "\n")